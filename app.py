@@ -1,10 +1,14 @@
 # app.py
+import io
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import folium
 from streamlit_folium import st_folium
-import math
 from datetime import datetime, timedelta
+from functools import lru_cache
 
 st.set_page_config(page_title="OSV Route Simulator", layout="wide")
 st.title("🚢 Offshore Supply Vessel Route Simulator")
@@ -21,27 +25,62 @@ if "waypoints" not in st.session_state:
 if "last_click" not in st.session_state:
     st.session_state.last_click = None
 
+# Pick up the latest map click before anything draws the waypoints,
+# so the new marker shows on this run without an extra rerun
+click_data = st.session_state.get("waypoint_map")
+if click_data and click_data.get("last_clicked"):
+    click = click_data["last_clicked"]
+    if st.session_state.last_click != click:
+        st.session_state.last_click = click
+        st.session_state.waypoints.append((click["lat"], click["lng"]))
+
 # -------------------------------
 # Helper Functions
 # -------------------------------
 def haversine_nm(lat1, lon1, lat2, lon2):
-    """Distance in nautical miles"""
+    """Distance in nautical miles (scalars or element-wise over arrays)"""
     R = 6371
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dl = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dl/2)**2
-    km = R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    lat1, lon1, lat2, lon2 = (np.asarray(v, dtype=float) for v in (lat1, lon1, lat2, lon2))
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = np.radians(lat2 - lat1)
+    dl = np.radians(lon2 - lon1)
+    a = np.sin(dphi/2)**2 + np.cos(phi1)*np.cos(phi2)*np.sin(dl/2)**2
+    km = R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
     return km / 1.852
 
-def interpolate(start, end, steps=60):
-    return [
-        (
-            start[0] + (end[0] - start[0]) * i / (steps - 1),
-            start[1] + (end[1] - start[1]) * i / (steps - 1),
-        )
-        for i in range(steps)
-    ]
+@lru_cache(maxsize=None)
+def _fractions(steps):
+    """(steps, 1) interpolation fractions 0..1, shared by every leg"""
+    frac = np.linspace(0, 1, steps)[:, None]
+    frac.flags.writeable = False
+    return frac
+
+def interpolate(route, steps=60):
+    """(legs * steps, 2) array of evenly spaced points along every leg of route"""
+    pts = np.asarray(route, dtype=float)
+    legs = pts[:-1, None, :] + (pts[1:] - pts[:-1])[:, None, :] * _fractions(steps)
+    return legs.reshape(-1, 2)
+
+def add_route_markers(m, start, end, waypoints):
+    """Port and waypoint markers shared by both maps"""
+    folium.Marker(start, tooltip="Start Port", icon=folium.Icon(color="blue", icon="anchor", prefix="fa")).add_to(m)
+    folium.Marker(end, tooltip="End Port", icon=folium.Icon(color="purple", icon="anchor", prefix="fa")).add_to(m)
+    for i, wp in enumerate(waypoints,1):
+        folium.Marker(wp, tooltip=f"Waypoint {i}", icon=folium.Icon(color="cadetblue", icon="flag", prefix="fa")).add_to(m)
+
+def to_csv_bytes(df):
+    """Serialize df with Arrow's CSV writer, in the same format as df.to_csv(index=False)"""
+    buf = io.BytesIO()
+    # Arrow quotes the header and writes floats like 19.0 / 1e-05 as 19 / 0.00001,
+    # so write the header ourselves and pass floats through pandas' own formatting
+    buf.write((",".join(df.columns) + "\n").encode("utf-8"))
+    floats = df.select_dtypes("float").columns
+    pacsv.write_csv(
+        pa.Table.from_pandas(df.astype({c: str for c in floats}), preserve_index=False),
+        buf,
+        pacsv.WriteOptions(include_header=False, quoting_style="none"),
+    )
+    return buf.getvalue()
 
 # -------------------------------
 # Sidebar Inputs
@@ -87,49 +126,41 @@ generate_btn = st.sidebar.button("🚀 Generate Voyage")
 # -------------------------------
 st.subheader("🗺️ Click on map to add waypoints")
 waypoint_map = folium.Map(location=[start_lat, start_lon], zoom_start=7)
-# Ports
-folium.Marker((start_lat, start_lon), tooltip="Start Port", icon=folium.Icon(color="blue", icon="anchor", prefix="fa")).add_to(waypoint_map)
-folium.Marker((end_lat, end_lon), tooltip="End Port", icon=folium.Icon(color="purple", icon="anchor", prefix="fa")).add_to(waypoint_map)
-# Existing waypoints
-for i, wp in enumerate(st.session_state.waypoints,1):
-    folium.Marker(wp, tooltip=f"Waypoint {i}", icon=folium.Icon(color="cadetblue", icon="flag", prefix="fa")).add_to(waypoint_map)
+# Ports + existing waypoints
+add_route_markers(waypoint_map, (start_lat, start_lon), (end_lat, end_lon), st.session_state.waypoints)
 
-click_data = st_folium(waypoint_map, width=1100, height=550, key="waypoint_map")
-
-# Add clicked waypoint
-if click_data and click_data.get("last_clicked"):
-    click = click_data["last_clicked"]
-    if st.session_state.last_click != click:
-        st.session_state.last_click = click
-        st.session_state.waypoints.append((click["lat"], click["lng"]))
-        st.experimental_rerun()
+st_folium(waypoint_map, width=1100, height=550, key="waypoint_map", returned_objects=["last_clicked"])
 
 # -------------------------------
 # Generate voyage
 # -------------------------------
 if generate_btn:
     route = [(start_lat, start_lon)] + st.session_state.waypoints + [(end_lat, end_lon)]
-    total_nm = sum(haversine_nm(*a,*b) for a,b in zip(route[:-1], route[1:]))
+    pts = np.asarray(route, dtype=float)
+    total_nm = float(haversine_nm(pts[:-1,0], pts[:-1,1], pts[1:,0], pts[1:,1]).sum())
     speed = speed_knots if speed_knots>0 else 10
     eta = datetime.utcnow() + timedelta(hours=total_nm/speed)
 
-    rows = []
-    t = datetime.utcnow()
-    for a,b in zip(route[:-1], route[1:]):
-        for lat,lon in interpolate(a,b):
-            rows.append([t.isoformat()+"Z","OSV_SIM","Transit",round(lat,5),round(lon,5),speed,"Underway"])
-            t += timedelta(minutes=1)
-    
-    st.session_state.voyage_df = pd.DataFrame(
-        rows, columns=["timestamp","vessel","phase","latitude","longitude","speed_knots","nav_status"]
-    )
+    coords = interpolate(pts)
+    timestamps = np.datetime64(datetime.utcnow(), "us") + np.arange(len(coords), dtype="timedelta64[m]")
+
+    st.session_state.voyage_df = pd.DataFrame({
+        "timestamp": np.char.add(np.datetime_as_string(timestamps, unit="us"), "Z"),
+        "vessel": "OSV_SIM",
+        "phase": "Transit",
+        "latitude": np.round(coords[:,0], 5),
+        "longitude": np.round(coords[:,1], 5),
+        "speed_knots": speed,
+        "nav_status": "Underway",
+    })
+    st.session_state.voyage_line = pts.tolist()
+    st.session_state.voyage_csv = to_csv_bytes(st.session_state.voyage_df)
     st.session_state.metrics = {"distance":total_nm,"speed":speed,"eta":eta}
 
 # -------------------------------
 # Output Section
 # -------------------------------
 if st.session_state.voyage_df is not None:
-    df = st.session_state.voyage_df
     metrics = st.session_state.metrics
 
     col1,col2,col3 = st.columns(3)
@@ -139,20 +170,16 @@ if st.session_state.voyage_df is not None:
 
     # Voyage map
     voyage_map = folium.Map(location=[start_lat, start_lon], zoom_start=7)
-    folium.PolyLine(list(zip(df.latitude, df.longitude)), color="blue", weight=3).add_to(voyage_map)
-    # Ports
-    folium.Marker((start_lat,start_lon), tooltip="Start Port", icon=folium.Icon(color="blue", icon="anchor", prefix="fa")).add_to(voyage_map)
-    folium.Marker((end_lat,end_lon), tooltip="End Port", icon=folium.Icon(color="purple", icon="anchor", prefix="fa")).add_to(voyage_map)
-    # Waypoints
-    for i, wp in enumerate(st.session_state.waypoints,1):
-        folium.Marker(wp, tooltip=f"Waypoint {i}", icon=folium.Icon(color="cadetblue", icon="flag", prefix="fa")).add_to(voyage_map)
+    folium.PolyLine(st.session_state.voyage_line, color="blue", weight=3).add_to(voyage_map)
+    # Ports + waypoints
+    add_route_markers(voyage_map, (start_lat,start_lon), (end_lat,end_lon), st.session_state.waypoints)
 
     st_folium(voyage_map, width=1100, height=600, key="voyage_map_display")
 
     # CSV download
     st.download_button(
         "⬇ Download Voyage CSV",
-        df.to_csv(index=False).encode("utf-8"),
+        st.session_state.voyage_csv,
         "custom_voyage.csv",
         "text/csv"
     )